@@ -1,5 +1,5 @@
 from logging import getLogger as get_logger
-from inspect import isawaitable
+from inspect import iscoroutinefunction
 from datetime import datetime
 from pathlib import Path
 from typing import Any
@@ -9,63 +9,89 @@ import json
 import sys
 import os
 
-from aiohttp import ClientSession
+from aiohttp import ClientSession, TCPConnector
 from dotenv import load_dotenv
 
-from core.utils import get_snapshot
-from tools.kit import gather_tools
+from tools.kit import close_sessions, gather_tools
 
 
 load_dotenv()
 _ENDPOINT = os.getenv("LLM_API_ENDPOINT")
 _MODEL = os.getenv("LLM_API_MODEL")
-_HEADERS = {"Authorization": f"Bearer {os.getenv('ZAI_API_KEY')}"}
+_HEADERS = {
+    "Authorization": f"Bearer {os.getenv('ZAI_API_KEY')}",
+    "Content-Type": "application/json",
+}
 _THINKING = "🧠"
 _CONTENT = "🤖"
 _TOOL_CALLS = "🛠️"
+_DRAIN_THRESHOLD = 4096
+_SSE_DATA = b"data: "
+_SSE_DONE = b"data: [DONE]"
+
+_LOGS_DIR = Path("logs")
+_LOGS_DIR.mkdir(exist_ok=True)
+_FORMATTER = logging.Formatter(
+    "%(asctime)s.%(msecs)03d T[%(threadName)10s] [%(levelname)8s] %(name)s: %(message)s (%(filename)s:%(lineno)s)"
+)
+_CONSOLE_HANDLER = logging.StreamHandler(sys.stdout)
+_CONSOLE_HANDLER.setLevel(logging.INFO)
+_CONSOLE_HANDLER.setFormatter(_FORMATTER)
+
+
+class _Lazy:
+    def __init__(self, fn):
+        self.fn = fn
+
+    def __str__(self):
+        return self.fn()
 
 
 class Agent:
-    def __init__(self, prompt: str, snap: bool):
-        if snap:
-            self.messages = [{"role": "system", "content": get_snapshot()}]
+    def __init__(self, prompt: str, snapshot: str | None = None):
+        if snapshot:
+            self.messages = [{"role": "system", "content": snapshot}]
         else:
             self.messages = []
         self.messages.append({"role": "user", "content": prompt})
         self.log = get_logger(__name__)
 
-        logs_dir = Path("logs")
-        logs_dir.mkdir(exist_ok=True)
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        log_file = logs_dir / f"agent_{timestamp}.log"
-        formatter = logging.Formatter(
-            "%(asctime)s.%(msecs)03d T[%(threadName)10s] [%(levelname)8s] %(name)s: %(message)s (%(filename)s:%(lineno)s)"
-        )
+        log_file = _LOGS_DIR / f"agent_{timestamp}.log"
         file_handler = logging.FileHandler(log_file)
         file_handler.setLevel(logging.DEBUG)
-        file_handler.setFormatter(formatter)
-        console_handler = logging.StreamHandler(sys.stdout)
-        console_handler.setLevel(logging.INFO)
-        console_handler.setFormatter(formatter)
+        file_handler.setFormatter(_FORMATTER)
         self.log.setLevel(logging.DEBUG)
         self.log.addHandler(file_handler)
-        self.log.addHandler(console_handler)
+        # shared handler, so repeated Agents don't duplicate console output
+        self.log.addHandler(_CONSOLE_HANDLER)
 
         self.reader: asyncio.StreamReader | None = None
         self.writer: asyncio.StreamWriter | None = None
+        self._write_bytes_since_drain = 0
         self._reader_transport: asyncio.ReadTransport | None = None
         self._writer_transport: asyncio.WriteTransport | None = None
+        self._session: ClientSession | None = None
         self.tools_schema, self.tools = gather_tools(self)
+        self._encoded_messages: list[str] = []
+        self._encoded_options = json.dumps(
+            {
+                "stream": True,
+                "tools": self.tools_schema,
+                "tool_stream": True,
+                "model": _MODEL,
+            }
+        )[1:-1]
 
     @property
-    def payload(self):
-        return {
-            "messages": self.messages,
-            "stream": True,
-            "tools": self.tools_schema,
-            "tool_stream": True,
-            "model": _MODEL,
-        }
+    def payload(self) -> str:
+        # each message is encoded once and later turns only pay for the new tail
+        # of the history, so entries of self.messages must never be mutated
+        # after append: the cached encoding would silently go stale
+        for message in self.messages[len(self._encoded_messages) :]:
+            self._encoded_messages.append(json.dumps(message))
+        messages = ", ".join(self._encoded_messages)
+        return f'{{"messages": [{messages}], {self._encoded_options}}}'
 
     async def __aenter__(self):
         self.reader = asyncio.StreamReader()
@@ -80,6 +106,9 @@ class Agent:
         self.writer = asyncio.StreamWriter(
             self._writer_transport, protocol, self.reader, loop
         )
+        self._session = ClientSession(
+            headers=_HEADERS, connector=TCPConnector(limit=16, ttl_dns_cache=300)
+        )
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
@@ -89,6 +118,8 @@ class Agent:
         self.reader.feed_eof()
         self._reader_transport.close()
         self._writer_transport.close()
+        await self._session.close()
+        await close_sessions()
 
     async def __call__(self):
         while True:
@@ -104,33 +135,22 @@ class Agent:
                     tool_call_data.append((tc, fn_name))
 
                     if fn := self.tools.get(fn_name):
-                        kwargs = json.loads(tc["function"]["arguments"])
-
-                        # Create coroutine for each tool call
-                        async def execute_tool(tool_func, tool_kwargs):
-                            self.log.debug(
-                                "executing tool[%s](tool_kwargs[%s])...",
-                                tool_func.__name__,
-                                tool_kwargs,
-                            )
-                            result = tool_func(**tool_kwargs)
-                            if isawaitable(result):
-                                result = await result
-                            return result
-
-                        tool_coroutines.append(execute_tool(fn, kwargs))
+                        tool_coroutines.append(
+                            self._execute_tool(fn, tc["function"]["arguments"])
+                        )
                     else:
-                        # For missing tools, create a coroutine that returns error message
-                        async def missing_tool():
-                            return f"{fn_name} not in tools[{list(self.tools.keys())}]"
-
-                        tool_coroutines.append(missing_tool())
+                        tool_coroutines.append(self._missing_tool(fn_name))
 
                 # Execute all tool calls concurrently
-                tool_results = await asyncio.gather(*tool_coroutines)
+                tool_results = await asyncio.gather(
+                    *tool_coroutines, return_exceptions=True
+                )
 
                 # Add all tool results to messages
                 for (tc, fn_name), res in zip(tool_call_data, tool_results):
+                    if isinstance(res, Exception):
+                        self.log.warning("tool[%s] raised error[%r]", fn_name, res)
+                        res = f"Error executing {fn_name}: {res!r}"
                     self.messages.append(
                         {
                             "role": "tool",
@@ -144,8 +164,26 @@ class Agent:
                 self.messages.append(response)
 
             prompt = await self.read(prefix=f"[{n_tokens}] > ")
+            if not prompt:
+                # stdin closed: stop instead of re-sending an empty turn forever
+                return
             self.messages.append({"role": "user", "content": prompt})
 
+    async def _execute_tool(self, tool_func, tool_args: str):
+        # parsed inside the coroutine so bad JSON is reported back as this
+        # call's result instead of ending the turn
+        tool_kwargs = json.loads(tool_args) if tool_args else {}
+        self.log.debug(
+            "executing tool[%s](tool_kwargs[%s])...", tool_func.__name__, tool_kwargs
+        )
+        if iscoroutinefunction(tool_func):
+            return await tool_func(**tool_kwargs)
+        # sync tools run off the loop so they can't stall siblings
+        return await asyncio.to_thread(tool_func, **tool_kwargs)
+
+    async def _missing_tool(self, fn_name: str):
+        return f"{fn_name} not in tools[{list(self.tools.keys())}]"
+
     async def read(self, prefix=""):
         if prefix:
             await self.write(prefix)
@@ -157,97 +195,113 @@ class Agent:
             data = data.encode(encoding="utf-8")
         self.writer.write(data)
         await self.writer.drain()
+        self._write_bytes_since_drain = 0
+
+    async def _write(self, data: str):
+        # streamed deltas only drain once enough output has piled up
+        data = data.encode(encoding="utf-8")
+        self.writer.write(data)
+        self._write_bytes_since_drain += len(data)
+        if self._write_bytes_since_drain > _DRAIN_THRESHOLD:
+            await self.writer.drain()
+            self._write_bytes_since_drain = 0
 
     async def get_response(self) -> tuple[dict[str, Any], int]:
-        self.log.debug("send payload[%s]", json.dumps(self.payload, indent=4))
-        async with ClientSession() as session:
-            async with session.post(
-                _ENDPOINT, headers=_HEADERS, json=self.payload
-            ) as resp:
-                started_reasoning = False
-                started_content = False
-                started_tool_calls = False
-                n_tokens = 0
-                tool_call_index = -1
-                message = {"role": "assistant"}
-
-                async for chunk_bytes in resp.content:
-                    self.log.debug("rcvd chunk_bytes[%s]", chunk_bytes)
-                    chunk = chunk_bytes.decode("utf-8").rstrip()
-                    if chunk.startswith("data: "):
-                        chunk = chunk[6:]
-                        if chunk == "[DONE]":
-                            await self.write("\n\n")
-                            self.log.debug(
-                                "rcvd n_tokens[%s] resp[%s]",
-                                n_tokens,
-                                json.dumps(message, indent=4),
+        body = self.payload
+        self.log.debug("send payload[%s]", body)
+        async with self._session.post(_ENDPOINT, data=body) as resp:
+            started_reasoning = False
+            started_content = False
+            started_tool_calls = False
+            n_tokens = 0
+            tool_call_index = -1
+            message = {"role": "assistant"}
+            reasoning_parts: list[str] = []
+            content_parts: list[str] = []
+            args_parts: dict[int, list[str]] = {}
+
+            # StreamReader iteration yields one line, i.e. one SSE field, per step
+            async for chunk_bytes in resp.content:
+                chunk_bytes = chunk_bytes.rstrip()
+                if not chunk_bytes:
+                    continue
+                self.log.debug("rcvd chunk_bytes[%s]", chunk_bytes)
+                if chunk_bytes.startswith(_SSE_DATA):
+                    if chunk_bytes == _SSE_DONE:
+                        await self.write("\n\n")
+                        if reasoning_parts:
+                            message["reasoning_content"] = "".join(reasoning_parts)
+                        if content_parts:
+                            message["content"] = "".join(content_parts)
+                        for i, parts in args_parts.items():
+                            message["tool_calls"][i]["function"]["arguments"] = "".join(
+                                parts
                             )
-                            return message, n_tokens
-
-                        chunk_json = json.loads(chunk)
-                        choice = chunk_json["choices"][0]
-                        if delta := choice.get("delta"):
-                            if reasoning_content := delta.get("reasoning_content"):
-                                if not started_reasoning:
-                                    await self.write(f"{_THINKING} ")
-                                    started_reasoning = True
-                                    message["reasoning_content"] = reasoning_content
-                                else:
-                                    message["reasoning_content"] += reasoning_content
-                                await self.write(reasoning_content)
-
-                            elif (
-                                content := delta.get("content", "\n")
-                            ) != "\n" and content:
-                                self.log.debug("delta content[%s]", content)
-                                if not started_content:
-                                    await self.write(f"\n\n{_CONTENT} ")
-                                    started_content = True
-                                    message["content"] = content
-                                else:
-                                    message["content"] += content
-                                await self.write(content)
-
-                            elif tool_calls := delta.get("tool_calls"):
-                                tc = tool_calls[0]
-                                args_data = tc["function"]["arguments"]
-                                if not started_tool_calls:
-                                    await self.write(f"\n\n{_TOOL_CALLS}  ")
-                                    started_tool_calls = True
-                                    message["tool_calls"] = []
-                                if tc.get("id"):
-                                    tool_call_index += 1
-                                    if tool_call_index:
-                                        await self.write(") ")
-
-                                    message["tool_calls"].append(
-                                        {
-                                            "type": "function",
-                                            "id": tc["id"],
-                                            "function": {
-                                                "name": tc["function"]["name"],
-                                                "arguments": args_data,
-                                            },
-                                        }
-                                    )
-                                    await self.write(
-                                        f"{tc['function']['name']}({args_data}"
-                                    )
-                                else:
-                                    message["tool_calls"][tool_call_index]["function"][
-                                        "arguments"
-                                    ] += args_data
-                                    await self.write(args_data)
-
-                        if finish_reason := choice.get("finish_reason"):
-                            if finish_reason == "tool_calls":
-                                await self.write(")")
-                            if timings := chunk_json.get("timings"):
-                                n_tokens = (
-                                    timings["cache_n"]
-                                    + timings["prompt_n"]
-                                    + timings["predicted_n"]
+                        self.log.debug(
+                            "rcvd n_tokens[%s] resp[%s]",
+                            n_tokens,
+                            _Lazy(lambda: json.dumps(message)),
+                        )
+                        return message, n_tokens
+
+                    chunk_json = json.loads(chunk_bytes[len(_SSE_DATA) :])
+                    choice = chunk_json["choices"][0]
+                    if delta := choice.get("delta"):
+                        if reasoning_content := delta.get("reasoning_content"):
+                            if not started_reasoning:
+                                await self._write(f"{_THINKING} ")
+                                started_reasoning = True
+                            reasoning_parts.append(reasoning_content)
+                            await self._write(reasoning_content)
+
+                        elif (
+                            content := delta.get("content", "\n")
+                        ) != "\n" and content:
+                            self.log.debug("delta content[%s]", content)
+                            if not started_content:
+                                await self._write(f"\n\n{_CONTENT} ")
+                                started_content = True
+                            content_parts.append(content)
+                            await self._write(content)
+
+                        elif tool_calls := delta.get("tool_calls"):
+                            tc = tool_calls[0]
+                            args_data = tc["function"]["arguments"]
+                            if not started_tool_calls:
+                                await self._write(f"\n\n{_TOOL_CALLS}  ")
+                                started_tool_calls = True
+                                message["tool_calls"] = []
+                            if tc.get("id"):
+                                tool_call_index += 1
+                                if tool_call_index:
+                                    await self._write(") ")
+
+                                message["tool_calls"].append(
+                                    {
+                                        "type": "function",
+                                        "id": tc["id"],
+                                        "function": {
+                                            "name": tc["function"]["name"],
+                                            "arguments": "",
+                                        },
+                                    }
+                                )
+                                args_parts[tool_call_index] = [args_data]
+                                await self._write(
+                                    f"{tc['function']['name']}({args_data}"
                                 )
-                            elif usage := chunk_json.get("usage"):
-                                n_tokens = usage["total_tokens"]
+                            else:
+                                args_parts[tool_call_index].append(args_data)
+                                await self._write(args_data)
+
+                    if finish_reason := choice.get("finish_reason"):
+                        if finish_reason == "tool_calls":
+                            await self._write(")")
+                        if timings := chunk_json.get("timings"):
+                            n_tokens = (
+                                timings["cache_n"]
+                                + timings["prompt_n"]
+                                + timings["predicted_n"]
+                            )
+                        elif usage := chunk_json.get("usage"):
+                            n_tokens = usage["total_tokens"]
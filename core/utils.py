@@ -1,7 +1,16 @@
 from pathlib import Path
+import asyncio
+import hashlib
+import json
+import mmap
+import os
 
 
 META_FILES = ["README.md", "pyproject.toml"]
+_ROOT_DIR = Path(__file__).parent.parent
+_SKIP_DIRS = {".venv", "venv", ".git", "__pycache__", "logs"}
+_CACHE_FILE = Path("logs") / ".snapshot.cache"
+_MMAP_THRESHOLD = 64 * 1024
 
 
 def _fmt_src(file: str | Path, base_dir: Path):
@@ -9,22 +18,71 @@ def _fmt_src(file: str | Path, base_dir: Path):
         relative_path = file
     else:
         relative_path = file.relative_to(base_dir)
-    txt = f"--- {relative_path} ---\n```"
-    with open(file, mode="r") as f:
-        for line in f.readlines():
-            txt += line
-    txt += "```\n\n"
-    return txt
+    body = _read_src(file)
+    return f"--- {relative_path} ---\n```{body}```\n\n"
 
 
-def get_snapshot():
-    root_dir = Path(__file__).parent.parent
-    snap_txt = ""
+def _read_src(file: str | Path):
+    with open(file, mode="rb") as f:
+        if os.fstat(f.fileno()).st_size < _MMAP_THRESHOLD:
+            return f.read().decode("utf-8", errors="replace")
+        # decode straight from the mapping, skipping the intermediate bytes copy
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return str(mm, "utf-8", "replace")
 
-    for file in META_FILES:
-        snap_txt += _fmt_src(file, root_dir)
 
-    for file in root_dir.rglob("*.py"):
-        if ".venv" not in str(file):
-            snap_txt += _fmt_src(file, root_dir)
+def _walk_py(dir_path: str | Path):
+    with os.scandir(dir_path) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name not in _SKIP_DIRS:
+                    yield from _walk_py(entry.path)
+            elif entry.name.endswith(".py"):
+                yield Path(entry.path)
+
+
+def _fingerprint(files: list[str | Path]):
+    # mtime + size only, so a warm start costs one stat per file and no reads
+    fp = hashlib.blake2b()
+    for file in sorted(files, key=str):
+        st = os.stat(file)
+        fp.update(f"{file}\0{st.st_mtime_ns}\0{st.st_size}\n".encode())
+    return fp.hexdigest()
+
+
+def _load_cache(fp: str):
+    try:
+        with open(_CACHE_FILE, mode="r") as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if isinstance(cached, dict) and cached.get("fp") == fp:
+        return cached.get("snap")
+    return None
+
+
+def _store_cache(fp: str, snap: str):
+    try:
+        _CACHE_FILE.parent.mkdir(exist_ok=True)
+        with open(_CACHE_FILE, mode="w") as f:
+            json.dump({"fp": fp, "snap": snap}, f)
+    except OSError:
+        pass
+
+
+async def get_snapshot():
+    src_files = list(_walk_py(_ROOT_DIR))
+
+    fp = _fingerprint([*META_FILES, *src_files])
+    if (snap_txt := _load_cache(fp)) is not None:
+        return snap_txt
+
+    parts = await asyncio.gather(
+        *(
+            asyncio.to_thread(_fmt_src, file, _ROOT_DIR)
+            for file in [*META_FILES, *src_files]
+        )
+    )
+    snap_txt = "".join(parts)
+    _store_cache(fp, snap_txt)
     return snap_txt
@@ -3,10 +3,12 @@ import asyncio
 import click
 
 from core.Agent import Agent
+from core.utils import get_snapshot
 
 
 async def main(prompt: str, snap: bool):
-    async with Agent(prompt, snap) as agent:
+    snapshot = await get_snapshot() if snap else None
+    async with Agent(prompt, snapshot) as agent:
         await agent()
 
 
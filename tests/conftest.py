@@ -0,0 +1,42 @@
+from pathlib import Path
+import tempfile
+import logging
+import shutil
+
+import pytest_asyncio
+import pytest
+
+from tools.kit import close_sessions, gather_tools
+
+
+_PROJECT_DIR = Path(__file__).parent.parent
+
+
+class MockRef:
+    """Mock reference object for testing gather_tools"""
+
+    def __init__(self):
+        self.log = logging.getLogger(__name__)
+
+
+@pytest.fixture(scope="session")
+def tools_kit():
+    """Discover the tools once for the whole test session"""
+    mock_ref = MockRef()
+    schemas, tools = gather_tools(mock_ref)
+    return mock_ref, schemas, tools
+
+
+@pytest_asyncio.fixture(autouse=True)
+async def _close_tool_sessions():
+    """Close the pooled tool sessions before each test's loop goes away"""
+    yield
+    await close_sessions()
+
+
+@pytest.fixture
+def project_tmp_path():
+    """Unique scratch dir inside the project root, so parallel workers never collide"""
+    path = Path(tempfile.mkdtemp(prefix=".pytest_tmp_", dir=_PROJECT_DIR))
+    yield path
+    shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,56 @@
+import json
+
+from core.Agent import _MODEL, Agent
+
+
+def _expected(agent):
+    # the body as it was built before the per-message encode cache
+    return json.loads(
+        json.dumps(
+            {
+                "messages": agent.messages,
+                "stream": True,
+                "tools": agent.tools_schema,
+                "tool_stream": True,
+                "model": _MODEL,
+            }
+        )
+    )
+
+
+def test_payload_matches_dict_form():
+    """Test that the incrementally built payload decodes to the plain dict body"""
+    agent = Agent('say "hi" to José ☕', snapshot="--- a.py ---\n```x = '\\n'```")
+    assert json.loads(agent.payload) == _expected(agent)
+
+    agent.messages.append(
+        {
+            "role": "assistant",
+            "content": "",
+            "tool_calls": [
+                {
+                    "type": "function",
+                    "id": "call_1",
+                    "function": {
+                        "name": "web_search",
+                        "arguments": '{"query": "naïve \\"quoted\\""}',
+                    },
+                }
+            ],
+        }
+    )
+    agent.messages.append(
+        {
+            "role": "tool",
+            "tool_call_id": "call_1",
+            "name": "web_search",
+            "content": "[]",
+        }
+    )
+    assert json.loads(agent.payload) == _expected(agent)
+
+    agent.messages.append({"role": "assistant", "content": "done 👍"})
+    agent.messages.append({"role": "user", "content": "thanks\t\\  "})
+    assert json.loads(agent.payload) == _expected(agent)
+    # encoding is stable across calls with no new messages
+    assert agent.payload == agent.payload
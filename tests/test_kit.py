@@ -1,22 +1,56 @@
-from pathlib import Path
+from collections import OrderedDict
 import logging
+import asyncio
+import time
 
+import aiohttp
 import pytest
 
-from tools.kit import gather_tools
+from tools.kit import _SESSIONS, close_sessions, gather_tools, shared_session
+from tools import crypto, search
 
 
-class MockRef:
-    """Mock reference object for testing gather_tools"""
+def test_gather_tools_cached(tools_kit):
+    """Test that tool discovery runs once and each ref keeps its own binding"""
+    mock_ref, schemas, tools = tools_kit
+    other_ref = type(mock_ref)()
+    schemas_again, tools_again = gather_tools(other_ref)
+    assert schemas_again is schemas
+    assert tools_again.keys() == tools.keys()
+    assert tools["web_search"].__self__ is mock_ref
+    assert tools_again["web_search"].__self__ is other_ref
+    params = tools["web_search"].schema["function"]["parameters"]
+    assert "self" not in params["properties"]
 
-    def __init__(self):
-        self.log = logging.getLogger(__name__)
+
+def test_shared_session_per_loop():
+    """Test that a session left on a closed loop is dropped and marked closed"""
+    created = []
+
+    def factory():
+        created.append(aiohttp.ClientSession())
+        return created[-1]
+
+    async def use(close):
+        session = shared_session("test", factory)
+        assert shared_session("test", factory) is session
+        if close:
+            await close_sessions()
+        return asyncio.get_running_loop()
+
+    # first loop ends without close_sessions(), like a killed run
+    first = asyncio.run(use(close=False))
+    assert first in _SESSIONS
+    second = asyncio.run(use(close=True))
+    assert first not in _SESSIONS
+    assert second not in _SESSIONS
+    assert len(created) == 2
+    assert all(session.closed for session in created)
 
 
 @pytest.mark.asyncio
-async def test_crypto_tool():
-    mock_ref = MockRef()
-    _, tools = gather_tools(mock_ref)
+async def test_crypto_tool(tools_kit):
+    _, _, tools = tools_kit
     assert "get_spot_pair_price" in tools
     tool = tools["get_spot_pair_price"]
     px = await tool("BTC-USD")
@@ -24,9 +58,39 @@ async def test_crypto_tool():
 
 
 @pytest.mark.asyncio
-async def test_shell_tool():
-    mock_ref = MockRef()
-    _, tools = gather_tools(mock_ref)
+async def test_crypto_tool_cache(tools_kit, monkeypatch):
+    """Test that concurrent price requests coalesce and the cache expires after _TTL"""
+    _, _, tools = tools_kit
+    tool = tools["get_spot_pair_price"]
+    calls = []
+
+    async def _fetch_mid(pair):
+        calls.append(pair)
+        await asyncio.sleep(0.01)
+        px = crypto.deci(len(calls))
+        crypto._PX_CACHE[pair] = (time.monotonic(), px)
+        return px
+
+    monkeypatch.setattr(crypto, "_fetch_mid", _fetch_mid)
+    monkeypatch.setattr(crypto, "_PX_CACHE", {})
+    monkeypatch.setattr(crypto, "_INFLIGHT", {})
+
+    pxs = await asyncio.gather(*[tool("BTC-USD") for _ in range(5)])
+    assert pxs == [1] * 5
+    assert calls == ["BTC-USD"]
+    assert await tool("BTC-USD") == 1
+    assert len(calls) == 1
+
+    # age the entry past the TTL
+    ts, px = crypto._PX_CACHE["BTC-USD"]
+    crypto._PX_CACHE["BTC-USD"] = (ts - crypto._TTL, px)
+    assert await tool("BTC-USD") == 2
+    assert calls == ["BTC-USD"] * 2
+
+
+@pytest.mark.asyncio
+async def test_shell_tool(tools_kit):
+    _, _, tools = tools_kit
     assert "execute_shell_command" in tools
     tool = tools["execute_shell_command"]
     res = await tool("echo 4")
@@ -35,131 +99,176 @@ async def test_shell_tool():
     assert res["stderr"] == ""
 
 
-def test_edit_tool_create_new_file():
+@pytest.mark.asyncio
+async def test_shell_tool_timeout(tools_kit):
+    """Test that a timed out command is killed along with its children"""
+    _, _, tools = tools_kit
+    tool = tools["execute_shell_command"]
+    start = time.monotonic()
+    res = await tool("sleep 5 | cat", timeout=1)
+    assert res["stderr"] == "Exceeded timeout[1s]"
+    assert time.monotonic() - start < 4
+
+
+def test_edit_tool_create_new_file(tools_kit, project_tmp_path):
     """Test creating a new file with the edit tool"""
-    mock_ref = MockRef()
-    _, tools = gather_tools(mock_ref)
+    _, _, tools = tools_kit
     assert "replace" in tools
     edit_tool = tools["replace"]
 
-    # Use the project directory for testing (must be within project root)
-    project_dir = Path(__file__).parent.parent
-    test_file = project_dir / "test_create_file.txt"
-
-    try:
-        # Create new file
-        result = edit_tool(
-            file_path=str(test_file), old_string="", new_string="Hello World"
-        )
-        assert result.startswith("Created new file")
-        assert test_file.exists()
-
-        # Verify content
-        with open(test_file, "r") as f:
-            content = f.read()
-        assert content == "Hello World"
-    finally:
-        # Clean up
-        if test_file.exists():
-            test_file.unlink()
-
-
-def test_edit_tool_modify_existing_file():
+    # Use a scratch dir inside the project (must be within project root)
+    test_file = project_tmp_path / "test_create_file.txt"
+
+    # Create new file
+    result = edit_tool(
+        file_path=str(test_file), old_string="", new_string="Hello World"
+    )
+    assert result.startswith("Created new file")
+    assert test_file.exists()
+
+    # Verify content
+    content = test_file.read_text()
+    assert content == "Hello World"
+
+
+def test_edit_tool_create_nested_file(tools_kit, project_tmp_path):
+    """Test creating a file whose parent directories don't exist yet"""
+    _, _, tools = tools_kit
+    edit_tool = tools["replace"]
+
+    test_file = project_tmp_path / "deep" / "nested" / "file.txt"
+    result = edit_tool(file_path=str(test_file), old_string="", new_string="nested")
+    assert result.startswith("Created new file")
+    assert test_file.read_text() == "nested"
+
+
+def test_edit_tool_modify_existing_file(tools_kit, project_tmp_path):
     """Test modifying an existing file with the edit tool"""
-    mock_ref = MockRef()
-    _, tools = gather_tools(mock_ref)
+    _, _, tools = tools_kit
     assert "replace" in tools
     edit_tool = tools["replace"]
 
-    # Use the project directory for testing (must be within project root)
-    project_dir = Path(__file__).parent.parent
-    test_file = project_dir / "test_modify_file.txt"
-
-    try:
-        # Create initial file with unique content
-        with open(test_file, "w") as f:
-            f.write("Original content\nThis is line 2\nThis is line 3")
-
-        # Modify existing content with exact match
-        result = edit_tool(
-            file_path=str(test_file),
-            old_string="This is line 2",
-            new_string="This is modified line 2",
-            expected_replacements=1,
-        )
-        assert result.startswith("Successfully modified")
-
-        # Verify content
-        with open(test_file, "r") as f:
-            content = f.read()
-        assert "Original content" in content
-        assert "This is modified line 2" in content
-        assert "This is line 3" in content
-        assert "This is line 2" not in content
-    finally:
-        # Clean up
-        if test_file.exists():
-            test_file.unlink()
-
-
-def test_edit_tool_modify_multiple_occurrences():
+    # Use a scratch dir inside the project (must be within project root)
+    test_file = project_tmp_path / "test_modify_file.txt"
+
+    # Create initial file with unique content
+    test_file.write_text("Original content\nThis is line 2\nThis is line 3")
+
+    # Modify existing content with exact match
+    result = edit_tool(
+        file_path=str(test_file),
+        old_string="This is line 2",
+        new_string="This is modified line 2",
+        expected_replacements=1,
+    )
+    assert result.startswith("Successfully modified")
+
+    # Verify content
+    content = test_file.read_text()
+    assert "Original content" in content
+    assert "This is modified line 2" in content
+    assert "This is line 3" in content
+    assert "This is line 2" not in content
+
+
+def test_edit_tool_modify_multiple_occurrences(tools_kit, project_tmp_path):
     """Test modifying multiple occurrences with expected_replacements"""
-    mock_ref = MockRef()
-    _, tools = gather_tools(mock_ref)
+    _, _, tools = tools_kit
     assert "replace" in tools
     edit_tool = tools["replace"]
 
-    # Use the project directory for testing (must be within project root)
-    project_dir = Path(__file__).parent.parent
-    test_file = project_dir / "test_multi_file.txt"
-
-    try:
-        # Create file with repeated content
-        with open(test_file, "w") as f:
-            f.write("Hello\nHello\nHello")
-
-        # Modify all 3 occurrences
-        result = edit_tool(
-            file_path=str(test_file),
-            old_string="Hello",
-            new_string="Hi",
-            expected_replacements=3,
-        )
-        assert result.startswith("Successfully modified")
-
-        # Verify content
-        with open(test_file, "r") as f:
-            content = f.read()
-        assert content == "Hi\nHi\nHi"
-    finally:
-        # Clean up
-        if test_file.exists():
-            test_file.unlink()
-
-
-def test_edit_tool_error_cases():
+    # Use a scratch dir inside the project (must be within project root)
+    test_file = project_tmp_path / "test_multi_file.txt"
+
+    # Create file with repeated content
+    test_file.write_text("Hello\nHello\nHello")
+
+    # Modify all 3 occurrences
+    result = edit_tool(
+        file_path=str(test_file),
+        old_string="Hello",
+        new_string="Hi",
+        expected_replacements=3,
+    )
+    assert result.startswith("Successfully modified")
+
+    # Verify content
+    content = test_file.read_text()
+    assert content == "Hi\nHi\nHi"
+
+
+def test_edit_tool_identical_replacement(tools_kit, project_tmp_path):
+    """Test that a replacement producing identical content leaves the file alone"""
+    _, _, tools = tools_kit
+    assert "replace" in tools
+    edit_tool = tools["replace"]
+
+    # Use a scratch dir inside the project (must be within project root)
+    test_file = project_tmp_path / "test_identical_file.txt"
+
+    test_file.write_text("Hello World")
+    mtime = test_file.stat().st_mtime_ns
+
+    result = edit_tool(file_path=str(test_file), old_string="Hello", new_string="Hello")
+    assert result.startswith("No changes")
+    assert test_file.stat().st_mtime_ns == mtime
+    assert test_file.read_text() == "Hello World"
+
+
+def test_edit_tool_writes_through_symlink(tools_kit, project_tmp_path):
+    """Test that editing via a symlink updates the linked file in place"""
+    _, _, tools = tools_kit
+    edit_tool = tools["replace"]
+
+    real_file = project_tmp_path / "sub" / "real.txt"
+    real_file.parent.mkdir()
+    real_file.write_text("Hello World")
+    alias = project_tmp_path / "alias.txt"
+    alias.symlink_to(real_file)
+
+    result = edit_tool(file_path=str(alias), old_string="Hello", new_string="Hi")
+    assert result.startswith("Successfully modified")
+    assert alias.is_symlink()
+    assert real_file.read_text() == "Hi World"
+
+
+def test_edit_tool_keeps_tmp_sibling(tools_kit, project_tmp_path):
+    """Test that an existing .tmp file next to the target is left alone"""
+    _, _, tools = tools_kit
+    edit_tool = tools["replace"]
+
+    test_file = project_tmp_path / "foo.txt"
+    test_file.write_text("Hello World")
+    sibling = project_tmp_path / "foo.txt.tmp"
+    sibling.write_text("keep me")
+
+    result = edit_tool(file_path=str(test_file), old_string="Hello", new_string="Hi")
+    assert result.startswith("Successfully modified")
+    assert test_file.read_text() == "Hi World"
+    assert sibling.read_text() == "keep me"
+    assert sorted(p.name for p in project_tmp_path.iterdir()) == [
+        "foo.txt",
+        "foo.txt.tmp",
+    ]
+
+
+def test_edit_tool_error_cases(tools_kit, project_tmp_path):
     """Test error cases for the edit tool"""
-    mock_ref = MockRef()
-    _, tools = gather_tools(mock_ref)
+    _, _, tools = tools_kit
     assert "replace" in tools
     edit_tool = tools["replace"]
 
-    # Use the project directory for testing (must be within project root)
-    project_dir = Path(__file__).parent.parent
+    # Use a scratch dir inside the project (must be within project root)
+    project_dir = project_tmp_path
 
     # Test 1: Attempt to create file that already exists
     existing_file = project_dir / "test_existing_file.txt"
-    try:
-        with open(existing_file, "w") as f:
-            f.write("existing content")
-
-        result = edit_tool(
-            file_path=str(existing_file), old_string="", new_string="new content"
-        )
-        assert "already exists" in result
-    finally:
-        if existing_file.exists():
-            existing_file.unlink()
+    existing_file.write_text("existing content")
+
+    result = edit_tool(
+        file_path=str(existing_file), old_string="", new_string="new content"
+    )
+    assert "already exists" in result
 
     # Test 2: Attempt to modify non-existent file
     non_existent_file = project_dir / "nonexistent.txt"
@@ -170,29 +279,23 @@ def test_edit_tool_error_cases():
 
     # Test 3: Attempt to modify string that doesn't exist
     test_file = project_dir / "test_string_file.txt"
-    try:
-        with open(test_file, "w") as f:
-            f.write("Hello World")
-
-        result = edit_tool(
-            file_path=str(test_file), old_string="NonExistent", new_string="Replacement"
-        )
-        assert "could not find the string to replace" in result
-
-        # Test 4: Wrong number of occurrences
-        with open(test_file, "w") as f:
-            f.write("Hello\nHello\nHello")
-
-        result = edit_tool(
-            file_path=str(test_file),
-            old_string="Hello",
-            new_string="Hi",
-            expected_replacements=2,  # But there are 3 occurrences
-        )
-        assert "expected 2 occurrences but found 3" in result
-    finally:
-        if test_file.exists():
-            test_file.unlink()
+    test_file.write_text("Hello World")
+
+    result = edit_tool(
+        file_path=str(test_file), old_string="NonExistent", new_string="Replacement"
+    )
+    assert "could not find the string to replace" in result
+
+    # Test 4: Wrong number of occurrences
+    test_file.write_text("Hello\nHello\nHello")
+
+    result = edit_tool(
+        file_path=str(test_file),
+        old_string="Hello",
+        new_string="Hi",
+        expected_replacements=2,  # But there are 3 occurrences
+    )
+    assert "expected 2 occurrences but found 3" in result
 
     # Test 5: Relative path (should fail)
     relative_file = "test_file.txt"
@@ -205,11 +308,25 @@ def test_edit_tool_error_cases():
     assert "must be within project root" in result
 
 
+def test_edit_tool_rejects_symlink_escape(tools_kit, project_tmp_path, tmp_path):
+    """Test that a symlinked directory can't be used to write outside the root"""
+    _, _, tools = tools_kit
+    edit_tool = tools["replace"]
+
+    link_dir = project_tmp_path / "linkdir"
+    link_dir.symlink_to(tmp_path, target_is_directory=True)
+
+    result = edit_tool(
+        file_path=str(link_dir / "escaped.txt"), old_string="", new_string="pwned"
+    )
+    assert "must be within project root" in result
+    assert not (tmp_path / "escaped.txt").exists()
+
+
 @pytest.mark.asyncio
-async def test_web_search_basic():
+async def test_web_search_basic(tools_kit):
     """Test basic web search functionality"""
-    mock_ref = MockRef()
-    _, tools = gather_tools(mock_ref)
+    _, _, tools = tools_kit
     assert "web_search" in tools
     web_tool = tools["web_search"]
 
@@ -235,10 +352,9 @@ async def test_web_search_basic():
 
 
 @pytest.mark.asyncio
-async def test_web_search_different_counts():
+async def test_web_search_different_counts(tools_kit):
     """Test web search with different result counts"""
-    mock_ref = MockRef()
-    _, tools = gather_tools(mock_ref)
+    _, _, tools = tools_kit
     assert "web_search" in tools
     web_tool = tools["web_search"]
 
@@ -256,10 +372,9 @@ async def test_web_search_different_counts():
 
 
 @pytest.mark.asyncio
-async def test_web_search_special_sites():
+async def test_web_search_special_sites(tools_kit):
     """Test web search with special site handlers"""
-    mock_ref = MockRef()
-    _, tools = gather_tools(mock_ref)
+    _, _, tools = tools_kit
     assert "web_search" in tools
     web_tool = tools["web_search"]
 
@@ -276,10 +391,9 @@ async def test_web_search_special_sites():
 
 
 @pytest.mark.asyncio
-async def test_web_search_error_handling():
+async def test_web_search_error_handling(tools_kit):
     """Test web search error handling"""
-    mock_ref = MockRef()
-    _, tools = gather_tools(mock_ref)
+    _, _, tools = tools_kit
     assert "web_search" in tools
     web_tool = tools["web_search"]
 
@@ -299,10 +413,9 @@ async def test_web_search_error_handling():
 
 
 @pytest.mark.asyncio
-async def test_web_search_debug_mode():
+async def test_web_search_debug_mode(tools_kit):
     """Test web search with debug mode enabled"""
-    mock_ref = MockRef()
-    _, tools = gather_tools(mock_ref)
+    _, _, tools = tools_kit
     assert "web_search" in tools
     web_tool = tools["web_search"]
 
@@ -316,3 +429,93 @@ async def test_web_search_debug_mode():
         assert "title" in result
         assert "url" in result
         assert "snippet" in result
+
+
+@pytest.fixture
+def fake_extract(monkeypatch):
+    """Swap the scrape fetcher for a counting stub and start from an empty cache"""
+    calls = []
+
+    async def _extract(log, session, url, max_paras):
+        calls.append(url)
+        await asyncio.sleep(0.01)
+        if "fail" in url:
+            raise RuntimeError("boom")
+        return f"body of {url}"
+
+    monkeypatch.setattr(search, "_extract", _extract)
+    monkeypatch.setattr(search, "_SCRAPE_CACHE", OrderedDict())
+    monkeypatch.setattr(search, "_SCRAPE_INFLIGHT", {})
+    return calls
+
+
+@pytest.mark.asyncio
+async def test_scrape_shares_inflight_fetch(fake_extract):
+    """Test that concurrent scrapes of one url share a single fetch"""
+    log = logging.getLogger(__name__)
+    bodies = await asyncio.gather(
+        *[search.scrape(log, None, "https://a.com", fallback="fb") for _ in range(5)]
+    )
+    assert bodies == ["body of https://a.com"] * 5
+    assert fake_extract == ["https://a.com"]
+    assert search._SCRAPE_INFLIGHT == {}
+
+    # served from cache afterwards
+    assert await search.scrape(log, None, "https://a.com", fallback="fb") == (
+        "body of https://a.com"
+    )
+    assert len(fake_extract) == 1
+
+
+@pytest.mark.asyncio
+async def test_scrape_caches_failures(fake_extract):
+    """Test that a failed scrape is cached and answered with the caller's fallback"""
+    log = logging.getLogger(__name__)
+    url = "https://fail.com"
+    assert await search.scrape(log, None, url, fallback="fb1") == "fb1"
+    assert await search.scrape(log, None, url, fallback="fb2") == "fb2"
+    assert fake_extract == [url]
+    expires_at, body = search._SCRAPE_CACHE[(url, 4)]
+    assert body is None
+    assert expires_at - time.monotonic() <= search._SCRAPE_ERROR_TTL
+
+
+@pytest.mark.asyncio
+async def test_scrape_cache_expiry(fake_extract, monkeypatch):
+    """Test that an expired entry is fetched again"""
+    log = logging.getLogger(__name__)
+    monkeypatch.setattr(search, "_SCRAPE_TTL", 0.0)
+    await search.scrape(log, None, "https://a.com", fallback="fb")
+    await search.scrape(log, None, "https://a.com", fallback="fb")
+    assert fake_extract == ["https://a.com"] * 2
+
+
+@pytest.mark.asyncio
+async def test_scrape_cache_lru_eviction(fake_extract, monkeypatch):
+    """Test that the least recently used entry is evicted past _SCRAPE_MAX"""
+    log = logging.getLogger(__name__)
+    monkeypatch.setattr(search, "_SCRAPE_MAX", 2)
+    for url in ("https://a.com", "https://b.com", "https://a.com", "https://c.com"):
+        await search.scrape(log, None, url, fallback="fb")
+    # a was touched after b, so b is the one evicted
+    assert [url for url, _ in search._SCRAPE_CACHE] == [
+        "https://a.com",
+        "https://c.com",
+    ]
+    await search.scrape(log, None, "https://b.com", fallback="fb")
+    assert fake_extract == [
+        "https://a.com",
+        "https://b.com",
+        "https://c.com",
+        "https://b.com",
+    ]
+
+
+def test_scrape_handler_routing():
+    """Test that only repo hosts reach the GitHub handler"""
+    assert search._handler("github.com") is search.gh_extract
+    assert search._handler("www.github.com") is search.gh_extract
+    assert search._handler("gist.github.com") is None
+    assert search._handler("notgithub.com") is None
+    assert search._handler("old.reddit.com") is search.reddit_extract
+    assert search._handler("stackoverflow.com") is search.so_extract
@@ -0,0 +1,75 @@
+import json
+import os
+
+import pytest
+
+from core import utils
+
+
+@pytest.fixture
+def snap_tree(tmp_path, monkeypatch):
+    """Small project tree with the snapshot root and cache pointed at it"""
+    (tmp_path / "README.md").write_text("readme")
+    (tmp_path / "pyproject.toml").write_text("[project]")
+    (tmp_path / "a.py").write_text("A = 1\n")
+    (tmp_path / "pkg").mkdir()
+    (tmp_path / "pkg" / "b.py").write_text("B = 2\n")
+    # META_FILES are relative to the working dir
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(utils, "_ROOT_DIR", tmp_path)
+    monkeypatch.setattr(utils, "_CACHE_FILE", tmp_path / "logs" / ".snapshot.cache")
+    return tmp_path
+
+
+def _no_reads(monkeypatch):
+    def _fmt_src(file, base_dir):
+        raise AssertionError(f"read {file}")
+
+    monkeypatch.setattr(utils, "_fmt_src", _fmt_src)
+
+
+@pytest.mark.asyncio
+async def test_snapshot_warm_hit(snap_tree, monkeypatch):
+    """Test that an unchanged tree is served from the cache without reading files"""
+    snap = await utils.get_snapshot()
+    assert "A = 1" in snap and "B = 2" in snap and "readme" in snap
+    assert utils._CACHE_FILE.exists()
+
+    _no_reads(monkeypatch)
+    assert await utils.get_snapshot() == snap
+
+
+@pytest.mark.asyncio
+async def test_snapshot_rebuilds_on_change(snap_tree):
+    """Test that a size or mtime change rebuilds the snapshot"""
+    await utils.get_snapshot()
+    a = snap_tree / "a.py"
+
+    # size change
+    a.write_text("A = 100\n")
+    assert "A = 100" in await utils.get_snapshot()
+
+    # same size, only the mtime tells them apart
+    st = a.stat()
+    a.write_text("A = 200\n")
+    os.utime(a, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+    assert "A = 200" in await utils.get_snapshot()
+
+
+@pytest.mark.asyncio
+async def test_snapshot_picks_up_new_file(snap_tree):
+    """Test that an added .py file invalidates the cache"""
+    await utils.get_snapshot()
+    (snap_tree / "pkg" / "c.py").write_text("C = 3\n")
+    assert "C = 3" in await utils.get_snapshot()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("cache_text", ["not json{", "[1, 2]", '{"fp": 1}'])
+async def test_snapshot_bad_cache_rebuilds(snap_tree, cache_text):
+    """Test that a corrupt or foreign cache file falls back to a rebuild"""
+    fresh = await utils.get_snapshot()
+    utils._CACHE_FILE.write_text(cache_text)
+    assert await utils.get_snapshot() == fresh
+    # and the rebuild rewrote a usable cache
+    assert json.loads(utils._CACHE_FILE.read_text())["snap"] == fresh
@@ -1,8 +1,45 @@
 from decimal import Decimal as deci
+import asyncio
+import json
+import time
 
-from aiohttp import ClientSession
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
 
-from tools.kit import tool
+from tools.kit import shared_session, tool
+
+
+_PRODUCTS_URL = "https://api.exchange.coinbase.com/products"
+_TTL = 1.0
+_PX_CACHE: dict[str, tuple[float, deci]] = {}
+_INFLIGHT: dict[str, asyncio.Future] = {}
+
+
+def _new_session():
+    return ClientSession(
+        connector=TCPConnector(limit=16, ttl_dns_cache=300),
+        timeout=ClientTimeout(total=10),
+    )
+
+
+async def _fetch_mid(pair: str):
+    session = shared_session("coinbase", _new_session)
+    # /ticker carries just the top of book, a fraction of the /book payload
+    async with session.get(f"{_PRODUCTS_URL}/{pair}/ticker") as resp:
+        if resp.ok:
+            resp_json = json.loads(await resp.read())
+            bid, ask = deci(resp_json["bid"]), deci(resp_json["ask"])
+        else:
+            bid, ask = await _fetch_best_bid_ask(session, pair)
+    px = (bid + ask) / deci(2)
+    _PX_CACHE[pair] = (time.monotonic(), px)
+    return px
+
+
+async def _fetch_best_bid_ask(session: ClientSession, pair: str):
+    async with session.get(f"{_PRODUCTS_URL}/{pair}/book?level=1") as resp:
+        resp.raise_for_status()
+        resp_json = json.loads(await resp.read())
+        return deci(resp_json["bids"][0][0]), deci(resp_json["asks"][0][0])
 
 
 @tool(
@@ -10,11 +47,12 @@ from tools.kit import tool
     pair="Hyphen-separated pair of spot instruments, e.g. BTC-USD",
 )
 async def get_spot_pair_price(pair: str):
-    async with ClientSession() as session:
-        async with session.get(
-            f"https://api.exchange.coinbase.com/products/{pair}/book"
-        ) as resp:
-            resp.raise_for_status()
-            resp_json = await resp.json()
-            bid, ask = deci(resp_json["bids"][0][0]), deci(resp_json["asks"][0][0])
-            return (bid + ask) / deci(2)
+    hit = _PX_CACHE.get(pair)
+    if hit and time.monotonic() - hit[0] < _TTL:
+        return hit[1]
+
+    # concurrent callers for the same pair share a single request
+    if (fut := _INFLIGHT.get(pair)) is None:
+        fut = _INFLIGHT[pair] = asyncio.ensure_future(_fetch_mid(pair))
+        fut.add_done_callback(lambda _: _INFLIGHT.pop(pair, None))
+    return await asyncio.shield(fut)
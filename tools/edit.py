@@ -1,9 +1,14 @@
 from pathlib import Path
+import tempfile
+import shutil
+import os
 
 from tools.kit import tool
 
 
 _ROOT_DIR = Path(__file__).parent.parent.resolve()
+_ROOT_STR = str(_ROOT_DIR)
+_ROOT_PREFIX = _ROOT_STR + os.sep
 
 
 _DESCRIPTION = f"""Edit (or create) a file by **literal string replacement**.
@@ -26,20 +31,39 @@ _PARAM_DOCS = dict(
 )
 
 
+def _within_root(file_path: str) -> bool:
+    # realpath follows symlinks, so a link inside the root can't lead out of it;
+    # it's a plain string op after that, no Path objects needed
+    real = os.path.realpath(file_path)
+    return real == _ROOT_STR or real.startswith(_ROOT_PREFIX)
+
+
+def _atomic_write(path_obj: Path, data: bytes):
+    # write beside the real file and rename over it, so a crash never leaves
+    # a half-written file and a symlink keeps pointing at the edited file
+    target = Path(os.path.realpath(path_obj))
+    fd, tmp = tempfile.mkstemp(dir=target.parent, prefix=f".{target.name}.")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        shutil.copymode(target, tmp)
+        os.replace(tmp, target)
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+
+
 @tool(_DESCRIPTION, **_PARAM_DOCS)
 def replace(
     file_path: str, old_string: str, new_string: str, expected_replacements: int = 1
 ) -> str:
     try:
-        root_dir = _ROOT_DIR
         path_obj = Path(file_path)
 
         # validate
         if not path_obj.is_absolute():
             return f"Error: file_path[{file_path}] must be absolute"
-        try:
-            path_obj.resolve().relative_to(root_dir)
-        except ValueError:
+        if not _within_root(file_path):
             return f"Error: file_path[{file_path}] must be within project root[{_ROOT_DIR}]"
         if expected_replacements < 1:
             return f"Error: expected_replacements[{expected_replacements}] must be >= 1"
@@ -50,7 +74,8 @@ def replace(
         if old_string == "":
             if file_exists:
                 return f"Error: Failed to edit. Attempted to create file[{file_path}] that already exists"
-            path_obj.parent.mkdir(parents=True, exist_ok=True)
+            if not path_obj.parent.exists():
+                path_obj.parent.mkdir(parents=True, exist_ok=True)
             path_obj.write_text(new_string, encoding="utf-8")
             return f"Created new file[{file_path}] with provided content"
 
@@ -58,8 +83,14 @@ def replace(
         if not file_exists:
             return f"Error: file[{file_path}] not found. Cannot apply edit. Use an empty old_string to create a new file."
 
-        current_content = path_obj.read_text(encoding="utf-8").replace("\r\n", "\n")
-        occurrences = current_content.count(old_string)
+        # literal substring work needs no decoding, so stay in bytes throughout
+        raw_content = path_obj.read_bytes()
+        current_content = raw_content
+        if b"\r" in current_content:
+            current_content = current_content.replace(b"\r\n", b"\n")
+        # one scan both counts the matches and yields the pieces to rejoin
+        parts = current_content.split(old_string.encode("utf-8"))
+        occurrences = len(parts) - 1
         if occurrences == 0:
             return (
                 "Error: Failed to edit, could not find the string to replace. "
@@ -72,8 +103,10 @@ def replace(
                 f"but found {occurrences}."
             )
 
-        new_content = current_content.replace(old_string, new_string)
-        path_obj.write_text(new_content, encoding="utf-8")
+        new_content = new_string.encode("utf-8").join(parts)
+        if new_content == raw_content:
+            return f"No changes to file: {file_path} (replacement is identical)."
+        _atomic_write(path_obj, new_content)
         return f"Successfully modified file: {file_path} ({occurrences} replacements)."
 
     except Exception as exc:
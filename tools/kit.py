@@ -1,6 +1,9 @@
 from pathlib import Path
-import importlib.util
+from types import MethodType
+import importlib
 import inspect
+import asyncio
+import typing
 
 
 _PYTHON_TO_JSON_TYPE = {
@@ -12,6 +15,16 @@ _PYTHON_TO_JSON_TYPE = {
     "str": "string",
 }
 
+_TOOL_FILES = [
+    p.stem
+    for p in sorted(Path(__file__).parent.glob("*.py"))
+    if p.name not in (Path(__file__).name, "__init__.py")
+]
+_CACHE: tuple[list, dict] | None = None
+# sessions are bound to the loop they were created on, so pool them per loop;
+# a plain dict, since each session holds its loop and a weak key would never die
+_SESSIONS: dict[asyncio.AbstractEventLoop, dict] = {}
+
 
 def tool(description, **arg_descriptions):
     def inner(func):
@@ -29,8 +42,9 @@ def tool(description, **arg_descriptions):
             },
         }
 
-        # Get function signature
+        # Get function signature, resolving all annotations in one pass
         sig = inspect.signature(func)
+        hints = typing.get_type_hints(func)
 
         # Process parameters
         for param_name, param in sig.parameters.items():
@@ -39,7 +53,8 @@ def tool(description, **arg_descriptions):
                 continue
 
             # Create parameter schema
-            param_type = _PYTHON_TO_JSON_TYPE.get(param.annotation.__name__, "string")
+            type_name = getattr(hints.get(param_name), "__name__", "str")
+            param_type = _PYTHON_TO_JSON_TYPE.get(type_name, "string")
             param_schema = {
                 "type": param_type,
                 "description": arg_descriptions.get(
@@ -63,19 +78,47 @@ def tool(description, **arg_descriptions):
     return inner
 
 
-def gather_tools(ref):
-    schemas = []
-    tools = {}
-    current_file, current_dir = Path(__file__).name, Path(__file__).parent
+def _prune_sessions():
+    # a loop closed without close_sessions() can't run the async close anymore;
+    # detach so the session counts as closed and drop the entry
+    for loop in [loop for loop in _SESSIONS if loop.is_closed()]:
+        for session in _SESSIONS.pop(loop).values():
+            if not session.closed:
+                session.detach()
+
+
+def shared_session(name, factory):
+    # one keep-alive session per name and loop, built by factory on first use
+    _prune_sessions()
+    sessions = _SESSIONS.setdefault(asyncio.get_running_loop(), {})
+    session = sessions.get(name)
+    if session is None or session.closed:
+        session = sessions[name] = factory()
+    return session
+
+
+async def close_sessions():
+    for session in _SESSIONS.pop(asyncio.get_running_loop(), {}).values():
+        await session.close()
+
 
-    for py_file in current_dir.glob("*.py"):
-        if py_file.name == current_file:
-            continue
+def _reset_cache():
+    global _CACHE
+    _CACHE = None
 
-        module_name = "tools." + py_file.stem
-        spec = importlib.util.spec_from_file_location(module_name, py_file)
-        module = importlib.util.module_from_spec(spec)
-        spec.loader.exec_module(module)
+
+def _discover():
+    # module import and schema building happen once per process
+    global _CACHE
+    if _CACHE is not None:
+        return _CACHE
+
+    schemas = []
+    funcs = {}
+
+    for stem in _TOOL_FILES:
+        # regular imports, so modules already in sys.modules are not re-executed
+        module = importlib.import_module(f"tools.{stem}")
 
         # find (coro) functions with a .schema attribute
         for name, obj in vars(module).items():
@@ -83,7 +126,19 @@ def gather_tools(ref):
                 inspect.isfunction(obj) or inspect.iscoroutinefunction(obj)
             ) and hasattr(obj, "schema"):
                 schemas.append(obj.schema)
-                tools[name] = obj
-                setattr(obj, "ref", ref)
+                # tools taking self want their owner, e.g. for its logger
+                funcs[name] = (obj, "self" in inspect.signature(obj).parameters)
 
+    _CACHE = schemas, funcs
+    return _CACHE
+
+
+def gather_tools(ref):
+    schemas, funcs = _discover()
+    # bind per call rather than mutating the shared functions, so every ref
+    # keeps its own tools
+    tools = {
+        name: MethodType(func, ref) if takes_self else func
+        for name, (func, takes_self) in funcs.items()
+    }
     return schemas, tools
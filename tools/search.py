@@ -1,16 +1,18 @@
 from urllib.parse import quote_plus, unquote
+from html import unescape
+from collections import OrderedDict
 import urllib.parse as up
-import textwrap
 import asyncio
-import base64
 import json
+import time
 import re
 
 
-from bs4 import BeautifulSoup
+from multidict import CIMultiDict, CIMultiDictProxy
+from bs4 import BeautifulSoup, SoupStrainer
 import aiohttp
 
-from tools.kit import tool
+from tools.kit import shared_session, tool
 
 
 UA = (
@@ -25,6 +27,10 @@ BROWSER_HEADERS = {
     "Referer": "https://duckduckgo.com/",
     "Connection": "keep-alive",
 }
+# aiohttp copies plain dicts into a CIMultiDict per request but takes multidicts
+# as they are, so build them once (multidict is a hard dependency of aiohttp)
+_HEADERS = CIMultiDictProxy(CIMultiDict(HEADERS))
+_BROWSER_HEADERS = CIMultiDictProxy(CIMultiDict(BROWSER_HEADERS))
 
 DDG = "https://duckduckgo.com/html/?q={q}&num={n}&kl=us-en"
 STACKPRINTER = (
@@ -33,47 +39,136 @@ STACKPRINTER = (
 )
 
 
-async def fetch(log, session, url, retry: True, *, as_json=False):
+def _new_session():
+    return aiohttp.ClientSession(
+        timeout=aiohttp.ClientTimeout(total=30),
+        connector=aiohttp.TCPConnector(
+            limit=200,
+            limit_per_host=32,
+            ttl_dns_cache=600,
+            keepalive_timeout=60,
+        ),
+    )
+
+
+MAX_BODY = 512 * 1024
+
+
+async def _read(r, as_json, max_bytes, text_only):
+    if as_json:
+        # truncated JSON is useless, so JSON bodies are read whole
+        return json.loads(await r.read())
+    if text_only and not r.content_type.startswith("text/"):
+        # binary body: skip it unread so the caller falls back to the snippet
+        return ""
+    buf = bytearray()
+    async for chunk in r.content.iter_chunked(16384):
+        buf += chunk
+        if len(buf) >= max_bytes:
+            break
+    try:
+        return buf.decode(r.charset or "utf-8", errors="ignore")
+    except LookupError:
+        return buf.decode("utf-8", errors="ignore")
+
+
+async def fetch(
+    log,
+    session,
+    url,
+    retry: True,
+    *,
+    as_json=False,
+    max_bytes=MAX_BODY,
+    headers=None,
+    text_only=False,
+):
     url = "http:" + url if url.startswith("//") else url
     log.debug("GET url[%s]", url)
-    async with session.get(url, headers=HEADERS, timeout=30) as r:
+    hdrs = {**HEADERS, **headers} if headers else _HEADERS
+    async with session.get(url, headers=hdrs, timeout=30) as r:
         if r.status in (401, 403) and retry:
-            async with session.get(url, headers=BROWSER_HEADERS, timeout=30) as r2:
+            hdrs = {**BROWSER_HEADERS, **headers} if headers else _BROWSER_HEADERS
+            async with session.get(url, headers=hdrs, timeout=30) as r2:
                 r2.raise_for_status()
-                return await (r2.json() if as_json else r2.text())
+                return await _read(r2, as_json, max_bytes, text_only)
         r.raise_for_status()
-        return await (r.json() if as_json else r.text())
+        return await _read(r, as_json, max_bytes, text_only)
+
+
+def _has_class(*names):
+    # strainers see the raw class attribute, e.g. "result results_links"
+    return lambda attr: attr is not None and not set(attr.split()).isdisjoint(names)
+
+
+# only build the parts of each page we read, not the whole DOM
+_DDG_RESULTS = SoupStrainer("div", class_=_has_class("result"))
+_PARAS = SoupStrainer("p")
+_SO_POSTS = SoupStrainer(class_=_has_class("question", "answer"))
+_RESULT_SEL, _A_SEL, _SN_SEL = "div.result", "a.result__a", "a.result__snippet"
 
 
 ###############################################################################
 # DUCKDUCKGO SEARCH → [(title, url, serp_snippet)]
 ###############################################################################
 def _shorten(s, n=800):
-    return textwrap.shorten(s.replace("\n", " "), n, placeholder="…")
+    s = s.replace("\n", " ")
+    if len(s) <= n:
+        return s
+    # back off to the last space so the preview ends on a word boundary
+    cut = s.rfind(" ", 0, n)
+    return (s[:cut] if cut > 0 else s[: n - 1]) + "…"
 
 
-async def ddg_search(log, query, k, debug):
-    async with aiohttp.ClientSession() as s:
-        html = await fetch(log, s, DDG.format(q=quote_plus(query), n=k), retry=True)
-    if debug:
-        log.debug("got DDG_RAW[%s]", _shorten(html))
+def _unwrap(url):
+    # strip DDG's /l/?uddg= redirect wrapper and resolve scheme-relative urls
+    if url.startswith("//"):
+        url = "https:" + url
+    if "/l/?" in url and (target := up.parse_qs(up.urlparse(url).query).get("uddg")):
+        url = unquote(target[0])
+    return url
+
 
-    soup = BeautifulSoup(html, "html.parser")
+def _ddg_parse(html, k):
+    soup = BeautifulSoup(html, "html.parser", parse_only=_DDG_RESULTS)
     hits = []
-    for res in soup.select("div.result")[:k]:
-        a, sn = res.select_one("a.result__a"), res.select_one("a.result__snippet")
+    # limit= stops the selector walk once k results are found
+    results = soup.select(_RESULT_SEL, limit=k) if k > 0 else []
+    for res in results:
+        a, sn = res.select_one(_A_SEL), res.select_one(_SN_SEL)
         if not a:
             continue
-        href = a["href"]
-        if "/l/?" in href:  # strip DDG redirect wrapper
-            href = unquote(up.parse_qs(up.urlparse(href).query)["uddg"][0])
         hits.append(
             (
                 a.get_text(" ", strip=True),
-                href,
+                _unwrap(a["href"]),
                 sn.get_text(" ", strip=True) if sn else "",
             )
         )
+    return hits
+
+
+async def _ddg_fetch(log, session, query, k):
+    return await fetch(log, session, DDG.format(q=quote_plus(query), n=k), retry=True)
+
+
+_FIRST_HIT = re.compile(r'<a[^>]+class="result__a"[^>]+href="([^"]+)"')
+
+
+async def ddg_search(log, session, query, k, debug):
+    html = await _ddg_fetch(log, session, query, k)
+    if debug:
+        log.debug("got DDG_RAW[%s]", _shorten(html))
+
+    # a cheap regex finds the top hit, so a handled domain starts scraping
+    # while the full parse runs; web_search then joins the in-flight scrape
+    if k > 0 and (m := _FIRST_HIT.search(html)):
+        url = _unwrap(unescape(m.group(1)))
+        if _handler(up.urlparse(url).hostname or ""):
+            _prefetch(log, session, url)
+
+    # parsing is CPU-bound, keep it off the loop so sibling fetches progress
+    hits = await asyncio.to_thread(_ddg_parse, html, k)
     log.debug("ddg extracted n_links[%s]", len(hits))
     return hits
 
@@ -81,17 +176,14 @@ async def ddg_search(log, query, k, debug):
 ###############################################################################
 # SPECIAL-CASE HANDLERS
 ###############################################################################
-SO_ID = re.compile(r"/questions/(\d+)")
-GH_BLOB = re.compile(r"https://github\.com/([^/]+)/([^/]+)/blob/([^/]+)/(.+)")
-GH_ROOT = re.compile(r"https://github\.com/([^/]+)/([^/]+?)(?:\.git)?/?$")
+# handlers get the url path, already split off by the router
+SO_ID = re.compile(r"^/questions/(\d+)")
+GH_README_MAX = 8192
+GH_RAW_HEADERS = {"Accept": "application/vnd.github.raw"}
 
 
-async def so_extract(session, url):
-    m = SO_ID.search(url)
-    if not m:
-        return ""
-    html = await fetch(session, STACKPRINTER.format(qid=m.group(1)), retry=False)
-    soup = BeautifulSoup(html, "html.parser")
+def _parse_so(html):
+    soup = BeautifulSoup(html, "html.parser", parse_only=_SO_POSTS)
     q = soup.select_one(".question .post-text")
     a = soup.select_one(".answer.accepted-answer .post-text") or soup.select_one(
         ".answer .post-text"
@@ -102,72 +194,151 @@ async def so_extract(session, url):
     )
 
 
-async def gh_extract(session, url):
-    # raw blob
-    m = GH_BLOB.match(url)
-    if m:
-        owner, repo, branch, path = m.groups()
-        raw_url = f"https://raw.githubusercontent.com/{owner}/{repo}/{branch}/{path}"
-        return await fetch(session, raw_url, retry=False)
-
-    # repo root → README via API
-    m = GH_ROOT.match(url)
-    if m:
-        owner, repo = m.groups()
+async def so_extract(log, session, url, path):
+    m = SO_ID.match(path)
+    if not m:
+        return ""
+    html = await fetch(log, session, STACKPRINTER.format(qid=m.group(1)), retry=False)
+    return await asyncio.to_thread(_parse_so, html)
+
+
+async def gh_extract(log, session, url, path):
+    parts = path.strip("/").split("/", 4)
+    # raw blob: /owner/repo/blob/branch/file
+    if len(parts) == 5 and parts[2] == "blob":
+        owner, repo, _, branch, file = parts
+        raw_url = f"https://raw.githubusercontent.com/{owner}/{repo}/{branch}/{file}"
+        return await fetch(log, session, raw_url, retry=False, text_only=True)
+
+    # repo root → README.md straight from raw, else whatever the API finds
+    if len(parts) == 2 and all(parts):
+        owner, repo = parts[0], parts[1].removesuffix(".git")
+        raw_url = f"https://raw.githubusercontent.com/{owner}/{repo}/HEAD/README.md"
+        try:
+            return await fetch(
+                log, session, raw_url, retry=True, max_bytes=GH_README_MAX
+            )
+        except aiohttp.ClientResponseError:
+            pass
+        # the raw media type gets the body verbatim, no JSON or base64 to undo
         api = f"https://api.github.com/repos/{owner}/{repo}/readme"
-        j = await fetch(session, api, retry=False, as_json=True)
-        content = base64.b64decode(j["content"]).decode("utf-8", errors="ignore")
-        return content
+        return await fetch(
+            log,
+            session,
+            api,
+            retry=False,
+            max_bytes=GH_README_MAX,
+            headers=GH_RAW_HEADERS,
+        )
     return ""
 
 
-async def reddit_extract(session, url):
+async def reddit_extract(log, session, url, path):
     # JSON endpoint returns list[ post, comments ]
     json_url = url.rstrip("/") + ".json?limit=20&raw_json=1"
-    data = await fetch(session, json_url, retry=False, as_json=True)
+    data = await fetch(log, session, json_url, retry=False, as_json=True)
     if not isinstance(data, list) or len(data) < 2:
         return ""
     post = data[0]["data"]["children"][0]["data"]
     comments = data[1]["data"]["children"]
-    top_comment = max(
-        (c for c in comments if c["kind"] == "t1"),
-        key=lambda c: c["data"].get("score", 0),
-        default=None,
-    )
+    top, top_score = None, None
+    for c in comments:
+        if c["kind"] != "t1":
+            continue
+        c_data = c["data"]
+        score = c_data.get("score", 0)
+        if top is None or score > top_score:
+            top, top_score = c_data, score
     post_txt = post.get("selftext") or post.get("title", "")
-    top_txt = top_comment["data"]["body"] if top_comment else ""
+    top_txt = top["body"] if top else ""
     return f"Post: {post_txt}  TopComment: {top_txt}"
 
 
 ###############################################################################
 # SCRAPE ROUTER
 ###############################################################################
-async def scrape(log, session, url, fallback, max_paras=4):
-    try:
-        dom = up.urlparse(url).netloc.lower()
+def _parse_paras(html, n):
+    soup = BeautifulSoup(html, "html.parser", parse_only=_PARAS)
+    return " ".join(p.get_text(" ", strip=True) for p in soup.find_all("p", limit=n))
+
+
+_HANDLERS = {
+    "stackoverflow.com": so_extract,
+    "reddit.com": reddit_extract,
+}
+# github subdomains (gist., docs., ...) aren't repos, so match exact hosts only
+_HOST_HANDLERS = {
+    "github.com": gh_extract,
+    "www.github.com": gh_extract,
+}
+
+
+def _handler(host):
+    # exact hosts first, then the registrable domain so www./old. share a handler
+    return _HOST_HANDLERS.get(host) or _HANDLERS.get(".".join(host.rsplit(".", 2)[-2:]))
 
-        if "stackoverflow.com" in dom:
-            return await so_extract(session, url) or fallback
 
-        if "github.com" in dom:
-            txt = await gh_extract(session, url)
-            return txt if txt else fallback
+async def _extract(log, session, url, max_paras):
+    parsed = up.urlparse(url)
+    handler = _handler(parsed.hostname or "")
+    if handler:
+        return await handler(log, session, url, parsed.path)
 
-        if "reddit.com" in dom:
-            txt = await reddit_extract(session, url)
-            return txt if txt else fallback
+    # generic HTML
+    html = await fetch(log, session, url, retry=True)
+    return await asyncio.to_thread(_parse_paras, html, max_paras)
 
-        # generic HTML
-        html = await fetch(log, session, url, retry=True)
-        paras = [
-            p.get_text(" ", strip=True)
-            for p in BeautifulSoup(html, "html.parser").select("p")[:max_paras]
-        ]
-        return " ".join(paras) or fallback
 
+###############################################################################
+# SCRAPE CACHE: (url, max_paras) → (expires_at, body or None on failure)
+###############################################################################
+_SCRAPE_TTL = 600.0
+_SCRAPE_ERROR_TTL = 60.0
+_SCRAPE_MAX = 1024
+_SCRAPE_CONCURRENCY = 16
+_SCRAPE_CACHE: OrderedDict[tuple[str, int], tuple[float, str | None]] = OrderedDict()
+_SCRAPE_INFLIGHT: dict[tuple[str, int], asyncio.Future] = {}
+
+
+async def _scrape_and_cache(log, session, key):
+    url, max_paras = key
+    try:
+        body, ttl = await _extract(log, session, url, max_paras), _SCRAPE_TTL
     except Exception as e:
         log.warning("Giving up on url[%s]: got error[%s]", url, e)
-        return fallback
+        body, ttl = None, _SCRAPE_ERROR_TTL
+    _SCRAPE_CACHE[key] = (time.monotonic() + ttl, body)
+    _SCRAPE_CACHE.move_to_end(key)
+    while len(_SCRAPE_CACHE) > _SCRAPE_MAX:
+        _SCRAPE_CACHE.popitem(last=False)
+    return body
+
+
+def _scrape_future(log, session, key):
+    # identical urls scraped concurrently share one fetch
+    if (fut := _SCRAPE_INFLIGHT.get(key)) is None:
+        fut = _SCRAPE_INFLIGHT[key] = asyncio.ensure_future(
+            _scrape_and_cache(log, session, key)
+        )
+        fut.add_done_callback(lambda _: _SCRAPE_INFLIGHT.pop(key, None))
+    return fut
+
+
+def _prefetch(log, session, url, max_paras=4):
+    key = (_unwrap(url), max_paras)
+    hit = _SCRAPE_CACHE.get(key)
+    if not (hit and hit[0] > time.monotonic()):
+        _scrape_future(log, session, key)
+
+
+async def scrape(log, session, url, fallback, max_paras=4):
+    url = _unwrap(url)
+    key = (url, max_paras)
+    hit = _SCRAPE_CACHE.get(key)
+    if hit and hit[0] > time.monotonic():
+        _SCRAPE_CACHE.move_to_end(key)
+        return hit[1] or fallback
+    return await asyncio.shield(_scrape_future(log, session, key)) or fallback
 
 
 ###############################################################################
@@ -178,21 +349,30 @@ async def scrape(log, session, url, fallback, max_paras=4):
     query="the query to search",
     k="number of results to include, default is 5",
 )
-async def web_search(query: str, k: int = 5, debug=False):
-    log = web_search.ref.log
-    links = await ddg_search(log, query, k, debug)
-    async with aiohttp.ClientSession() as sess:
-        bodies = await asyncio.gather(
-            *[scrape(log, sess, u, fallback=snip) for _, u, snip in links],
-            return_exceptions=True,
-        )
-    out = [
-        {"title": t, "url": u, "snippet": b if isinstance(b, str) else ""}
-        for (t, u, _), b in zip(links, bodies)
-    ]
+async def web_search(self, query: str, k: int = 5, debug=False):
+    log = self.log
+    # one keep-alive session serves the SERP fetch and every scrape
+    session = shared_session("search", _new_session)
+    links = await ddg_search(log, session, query, k, debug)
+
+    # bound the fan-out so a large k can't open a connection per link at once
+    sem = asyncio.Semaphore(_SCRAPE_CONCURRENCY)
+
+    async def _bounded(url, snip):
+        async with sem:
+            return await scrape(log, session, url, fallback=snip)
+
+    # scrape each url once, even if the SERP lists it under several titles
+    uniq = {}
+    for _, u, snip in links:
+        uniq.setdefault(u, snip)
+    bodies = await asyncio.gather(
+        *[_bounded(u, snip) for u, snip in uniq.items()],
+        return_exceptions=True,
+    )
+    body_by_url = {u: b if isinstance(b, str) else "" for u, b in zip(uniq, bodies)}
+    out = [{"title": t, "url": u, "snippet": body_by_url[u]} for t, u, _ in links]
     if debug:
-        import sys
-
-        json.dump(out, sys.stdout, indent=2, ensure_ascii=False)
-        print()
+        # json.dump issues a write per token; encode once and print it whole
+        print(json.dumps(out, indent=2, ensure_ascii=False))
     return out
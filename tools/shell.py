@@ -1,8 +1,20 @@
 import asyncio
+import signal
+import os
 
 from tools.kit import tool
 
 
+MAX_OUT = 1_000_000
+
+
+async def _drain(stream, buf):
+    # keep reading past the cap so the child never blocks on a full pipe
+    while chunk := await stream.read(65536):
+        if len(buf) < MAX_OUT:
+            buf += chunk[: MAX_OUT - len(buf)]
+
+
 @tool(
     "Execute a shell command asynchronously and return the result",
     command="The shell command to execute",
@@ -10,17 +22,32 @@ from tools.kit import tool
 )
 async def execute_shell_command(command: str, timeout: int = 30):
     """Execute a shell command asynchronously and return the result."""
+    process = await asyncio.create_subprocess_shell(
+        command,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        start_new_session=True,
+    )
+    stdout, stderr = bytearray(), bytearray()
     try:
-        process = await asyncio.create_subprocess_shell(
-            command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-        )
-
-        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=timeout)
-
-        return {
-            "returncode": process.returncode,
-            "stdout": stdout.decode("utf-8").strip() if stdout else "",
-            "stderr": stderr.decode("utf-8").strip() if stderr else "",
-        }
+        # a timeout scope, unlike wait_for, doesn't wrap the gather in a task
+        async with asyncio.timeout(timeout):
+            await asyncio.gather(
+                _drain(process.stdout, stdout),
+                _drain(process.stderr, stderr),
+                process.wait(),
+            )
     except TimeoutError:
+        # kill the whole group: a surviving grandchild would hold the pipes open
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        await process.wait()
         return {"stderr": f"Exceeded timeout[{timeout}s]"}
+
+    return {
+        "returncode": process.returncode,
+        "stdout": stdout.decode("utf-8", errors="replace").strip(),
+        "stderr": stderr.decode("utf-8", errors="replace").strip(),
+    }